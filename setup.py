@@ -36,8 +36,17 @@ import sys
 from glob import glob
 from os.path import basename, dirname, join, splitext
 
+from setuptools import Extension
 from setuptools import find_packages
 from setuptools import setup
+from setuptools.command.build_ext import build_ext
+
+try:
+    # Cython is optional; if present, the bulk distance
+    # calculation is compiled into a C extension
+    from Cython.Build import cythonize
+except ImportError:
+    cythonize = None
 
 
 if sys.version_info < (3, 5):
@@ -55,6 +64,44 @@ def read(*names, **kwargs):
         return ""
 
 
+class optional_build_ext(build_ext):
+
+    """ Build the C extensions if possible, but fall back to the
+        pure-Python implementation instead of failing the installation
+        if they cannot be compiled (e.g. if there is no C compiler) """
+
+    def run(self):
+        try:
+            build_ext.run(self)
+        except Exception as e:
+            self._warn(e)
+
+    def build_extension(self, ext):
+        try:
+            build_ext.build_extension(self, ext)
+        except Exception as e:
+            self._warn(e)
+
+    @staticmethod
+    def _warn(e):
+        print(
+            "Warning: unable to build the optional C extension ({0}); "
+            "using the pure-Python implementation instead".format(e)
+        )
+
+
+ext_modules = []
+if cythonize is not None:
+    try:
+        ext_modules = cythonize(
+            [Extension("straeto._haversine", ["src/straeto/_haversine.pyx"])],
+            language_level=3,
+        )
+    except Exception as e:
+        # E.g. a Cython version that cannot compile the .pyx file
+        optional_build_ext._warn(e)
+
+
 setup(
     name="straeto",
     # Remember to modify version number in src/straeto/__init__.py as well
@@ -69,8 +116,10 @@ setup(
     packages=find_packages("src"),
     package_dir={"": "src"},
     py_modules=[splitext(basename(path))[0] for path in glob("src/*.py")],
+    ext_modules=ext_modules,
+    cmdclass={"build_ext": optional_build_ext},
     include_package_data=True,
-    zip_safe=True,
+    zip_safe=not ext_modules,
     classifiers=[
         # complete classifier list: http://pypi.python.org/pypi?%3Aaction=list_classifiers
         "Development Status :: 3 - Alpha",
@@ -94,5 +143,5 @@ setup(
     ],
     keywords=["bus", "route", "transportation", "iceland"],
     setup_requires=[],
-    install_requires=["requests>=2.20"],
+    install_requires=["requests>=2.20", "numpy>=1.16"],
 )
@@ -34,6 +34,7 @@ from .straeto import (
     BusStop,
     BusHalt,
     distance,
+    distance_batch,
     locfmt,
 )
 
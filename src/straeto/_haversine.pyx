@@ -0,0 +1,63 @@
+# cython: language_level=3, boundscheck=False, wraparound=False, cdivision=True
+"""
+
+    Straeto: A package encapsulating information about buses and bus routes
+
+    _haversine.pyx: Optional C extension for bulk Haversine distances
+
+    Copyright (C) 2019 Miðeind ehf.
+
+        This program is free software: you can redistribute it and/or modify
+        it under the terms of the GNU General Public License as published by
+        the Free Software Foundation, either version 3 of the License, or
+        (at your option) any later version.
+
+        This program is distributed in the hope that it will be useful,
+        but WITHOUT ANY WARRANTY; without even the implied warranty of
+        MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+        GNU General Public License for more details.
+
+    You should have received a copy of the GNU General Public License
+    along with this program.  If not, see <https://www.gnu.org/licenses/>.
+
+    This module is compiled by setup.py if Cython is available.
+    It releases the GIL while calculating distances, so other threads
+    can run in the meantime. straeto.distance_batch() uses it if
+    it has been built, and otherwise falls back to NumPy.
+
+"""
+
+from libc.math cimport sin, cos, atan2, sqrt, M_PI
+
+cdef double _DEG_TO_RAD = M_PI / 180.0
+
+
+cdef inline double _haversine(
+    double lat1, double lon1, double lat2, double lon2, double radius
+) noexcept nogil:
+    """ The Haversine distance between two (lat, lon) points,
+        given in degrees, on a sphere of the given radius """
+    cdef double slat = sin((lat2 - lat1) * _DEG_TO_RAD / 2)
+    cdef double slon = sin((lon2 - lon1) * _DEG_TO_RAD / 2)
+    cdef double a = (
+        slat * slat +
+        cos(lat1 * _DEG_TO_RAD) * cos(lat2 * _DEG_TO_RAD) *
+        slon * slon
+    )
+    return radius * 2 * atan2(sqrt(a), sqrt(1 - a))
+
+
+def haversine_array(
+    const double[:, ::1] pts, double lat0, double lon0,
+    double radius, double[::1] out
+):
+    """ Store in out[i] the Haversine distance from (lat0, lon0)
+        to the (lat, lon) point in pts[i], for an (N, 2) array pts.
+        The radius, and hence the unit of the result, is passed in
+        by straeto.distance_batch() as straeto._EARTH_RADIUS. """
+    cdef Py_ssize_t i, n = pts.shape[0]
+    if out.shape[0] < n:
+        raise ValueError("Output array is too small")
+    with nogil:
+        for i in range(n):
+            out[i] = _haversine(lat0, lon0, pts[i, 0], pts[i, 1], radius)
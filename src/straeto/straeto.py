@@ -41,29 +41,58 @@
 
 import os
 import re
+import sys
+import csv
 import math
 from datetime import date, time, datetime, timedelta
+from time import monotonic
 import threading
 import functools
 from collections import defaultdict
-import xml.etree.ElementTree as ET
+from operator import itemgetter
+from itertools import groupby
 
+import numpy as np
 import requests
 
+try:
+    # Prefer the C-based lxml parser, if available
+    from lxml import etree as ET
+except ImportError:
+    import xml.etree.ElementTree as ET
+
+try:
+    # Numba is optional; if present, it is used to compile the
+    # scalar distance kernel to native code
+    from numba import njit
+except ImportError:
+    njit = None
+
+try:
+    # The Cython extension is optional; it is built by setup.py
+    # if Cython is available
+    from ._haversine import haversine_array
+except ImportError:
+    haversine_array = None
+
 
 _THIS_PATH = os.path.dirname(__file__) or "."
 # Where the URL to fetch bus status data is stored (this is not public information;
 # you must apply to Straeto bs to obtain permission and get your own URL)
 _STATUS_URL_FILE = os.path.join(_THIS_PATH, "config", "status_url.txt")
-try:
-    _STATUS_URL = open(_STATUS_URL_FILE, "r").read().strip()
-except FileNotFoundError:
-    _STATUS_URL = None
 # Real-time status refresh interval
 _REFRESH_INTERVAL = 60
 # Fallback location to fetch status info from, if not available via HTTP
 _STATUS_FILE = os.path.join(_THIS_PATH, "resources", "status.xml")
 _EARTH_RADIUS = 6371.0088  # Earth's radius in km
+# Minimum number of stops for which a BallTree is built for nearest-stop
+# queries (if scikit-learn is available). Below this, a vectorized scan
+# over all stops is as fast, and avoids the cost of importing scikit-learn.
+_BALL_TREE_MIN_STOPS = 5000
+# Maximum extent, in degrees of latitude and longitude, of a set of locations
+# that may be ranked by distance using the equirectangular approximation
+# (about 55 km north-south and 25 km east-west at Icelandic latitudes)
+_RANK_DISTANCE_MAX_SPAN = 0.5
 _MIDEIND_LOCATION = (64.156896, -21.951200)  # Fiskislóð 31, 101 Reykjavík
 
 _VOICE_NAMES = {
@@ -97,6 +126,17 @@ _VOICE_NAMES = {
 _DEFAULT_AREA_PRIORITY = ("ST", "SU", "VL", "SN", "NO", "RY", "AF")
 
 
+@functools.lru_cache(maxsize=1)
+def _status_url():
+    """ Return the URL to fetch bus status data from, or None if it
+        is not configured. The URL file is read on first use only. """
+    try:
+        with open(_STATUS_URL_FILE, "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
 def distance(loc1, loc2):
     """
     Calculate the Haversine distance.
@@ -126,7 +166,12 @@ def distance(loc1, loc2):
     """
     lat1, lon1 = loc1
     lat2, lon2 = loc2
+    return _haversine(lat1, lon1, lat2, lon2)
 
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """ The Haversine distance kernel, in km, operating on plain floats.
+        This is compiled with Numba, if available. """
     dlat = math.radians(lat2 - lat1)
     dlon = math.radians(lon2 - lon1)
     slat = math.sin(dlat / 2)
@@ -140,8 +185,76 @@ def distance(loc1, loc2):
     return _EARTH_RADIUS * c
 
 
-# Entfernung - used for test purposes
-entf = functools.partial(distance, _MIDEIND_LOCATION)
+def _distance_from_radians(lat1, lon1, lat2, lon2, cos1, cos2):
+    """ The Haversine distance kernel, in km, for locations whose
+        coordinates have already been converted to radians and whose
+        latitude cosines (cos1, cos2) have been precomputed """
+    slat = math.sin((lat2 - lat1) / 2)
+    slon = math.sin((lon2 - lon1) / 2)
+    a = slat * slat + cos1 * cos2 * slon * slon
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return _EARTH_RADIUS * c
+
+
+if njit is not None:
+    _haversine = njit(cache=True, fastmath=True)(_haversine)
+    _distance_from_radians = njit(cache=True, fastmath=True)(_distance_from_radians)
+
+
+def distance_batch(origin, locs):
+    """
+    Calculate the Haversine distance from an origin to many locations at once.
+
+    Parameters
+    ----------
+    origin : tuple of float
+        (lat, long)
+    locs : array-like of shape (N, 2)
+        (lat, long) pairs
+
+    Returns
+    -------
+    distances_in_km : numpy.ndarray of shape (N,)
+
+    Examples
+    --------
+    >>> origin = (48.1372, 11.5756)  # Munich
+    >>> destinations = [(52.5186, 13.4083), (48.1372, 11.5756)]  # Berlin, Munich
+    >>> [round(float(d), 1) for d in distance_batch(origin, destinations)]
+    [504.2, 0.0]
+
+    """
+    locs = np.asarray(locs, dtype=np.float64).reshape(-1, 2)
+    if haversine_array is not None:
+        # Use the compiled extension, which releases the GIL
+        locs = np.ascontiguousarray(locs)
+        out = np.empty(len(locs), dtype=np.float64)
+        haversine_array(locs, origin[0], origin[1], _EARTH_RADIUS, out)
+        return out
+    lat1, lon1 = map(math.radians, origin)
+    lat2 = np.radians(locs[:, 0])
+    lon2 = np.radians(locs[:, 1])
+    slat = np.sin((lat2 - lat1) / 2)
+    slon = np.sin((lon2 - lon1) / 2)
+    a = slat * slat + math.cos(lat1) * np.cos(lat2) * slon * slon
+    c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+    return _EARTH_RADIUS * c
+
+
+def _rank_distance(loc1, loc2, _cos=math.cos, _radians=math.radians):
+    """ Return a value that increases monotonically with the distance
+        between two nearby locations, using an equirectangular projection.
+        This is much cheaper than the Haversine formula, and is suitable
+        for ranking locations by distance within a city-sized area. """
+    x = (loc2[1] - loc1[1]) * _cos(_radians((loc1[0] + loc2[0]) * 0.5))
+    y = loc2[0] - loc1[0]
+    return x * x + y * y
+
+
+def entf(loc, _origin=_MIDEIND_LOCATION, _distance=distance):
+    """ Entfernung - distance from Miðeind, used for test purposes.
+        The defaults bind the origin and function as fast locals. """
+    return _distance(_origin, loc)
 
 
 def locfmt(loc):
@@ -191,24 +304,22 @@ class BusCalendar:
         """ Read information about the service calendar from
             the calendar_dates.txt file """
         BusCalendar._calendar = defaultdict(set)
+        # Any cached service activity is now stale
+        BusService._active_by_date.clear()
         with open(
             os.path.join(_THIS_PATH, "resources", "calendar_dates.txt"),
-            "r",
+            "r", newline="",
         ) as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            for row in reader:
+                if not row:
                     continue
                 # Format is:
                 # service_id,date,exception_type
-                f = line.split(",")
-                assert len(f) == 3
-                d = f[1].strip()
+                assert len(row) == 3
+                d = row[1].strip()
                 year = int(d[0:4])
                 month = int(d[4:6])
                 day = int(d[6:8])
@@ -217,7 +328,7 @@ class BusCalendar:
                 assert 1 <= day <= 31
                 # Add this service id to the set of services that are active
                 # on the indicated date
-                BusCalendar._calendar[date(year, month, day)].add(f[0].strip())
+                BusCalendar._calendar[date(year, month, day)].add(row[0].strip())
 
 
 class BusTrip:
@@ -226,6 +337,13 @@ class BusTrip:
         spanning several Stops that are visited at points in time given
         in Halts. """
 
+    __slots__ = (
+        "_id", "_route_id", "_headsign", "_short_name", "_direction", "_block",
+        "_halts", "_stops", "_consecutive_stops", "_sorted_halts",
+        "_first_stop", "_last_stop_seq", "_last_stop",
+        "_start_time", "_end_time",
+    )
+
     _all_trips = dict()
 
     def __init__(self, *, trip_id, route_id, headsign, short_name, direction, block):
@@ -404,7 +522,13 @@ class BusService:
     """ A BusService encapsulates a set of trips on a BusRoute that can be
         active on a particular date, as determined by a BusCalendar """
 
+    __slots__ = (
+        "_id", "_trips", "_service", "_valid_from", "_weekdays_mask", "_ordered_trips",
+    )
+
     _all_services = dict()
+    # Cache of frozensets of active service ids, keyed by date ordinal
+    _active_by_date = dict()
 
     def __init__(self, service_id):
         # The service id is a route id + '/' + a nonunique service id
@@ -417,15 +541,19 @@ class BusService:
             int(schedule[4:6]),
             int(schedule[6:8]),
         )
-        # Decode weekday validity of service,
+        # Decode weekday validity of service into a bit mask,
+        # where bit 0 is Monday and bit 6 is Sunday
         # M T W T F S S
-        self._weekdays = [
-            c != "-" for c in schedule[9:16]
-        ]
+        mask = 0
+        for ix, c in enumerate(schedule[9:16]):
+            if c != "-":
+                mask |= 1 << ix
+        self._weekdays_mask = mask
         # List of trips, ordered by start time
         self._ordered_trips = []
         # Collect all services in a single dict
         BusService._all_services[service_id] = self
+        BusService._active_by_date.clear()
 
     @staticmethod
     def initialize():
@@ -440,6 +568,19 @@ class BusService:
             key=lambda trip: trip.start_time
         )
 
+    @classmethod
+    def active_on_date(cls, on_date):
+        """ Return a frozenset of the ids of all services
+            that are active on the given date """
+        key = on_date.toordinal()
+        active = cls._active_by_date.get(key)
+        if active is None:
+            active = cls._active_by_date[key] = frozenset(
+                s._id for s in cls._all_services.values()
+                if s.is_active_on_date(on_date)
+            )
+        return active
+
     @staticmethod
     def lookup(service_id):
         """ Get a BusService by its identifier """
@@ -458,14 +599,14 @@ class BusService:
         """ Returns True if the service is active on the given date """
         return (
             # self._valid_from <= on_date and
-            # self._weekdays[on_date.weekday()] and
+            # self.is_active_on_weekday(on_date.weekday()) and
             self._service in BusCalendar.lookup(on_date)
         )
 
     def is_active_on_weekday(self, weekday):
         """ Returns True if the service is active on the given weekday.
             This is currently not reliable. """
-        return self._weekdays[weekday]
+        return bool(self._weekdays_mask >> weekday & 1)
 
     def add_trip(self, trip):
         """ Add a trip to this service """
@@ -479,6 +620,8 @@ class BusRoute:
         Each BusTrip involves a number of BusStops, via a number
         of BusHalts. """
 
+    __slots__ = ("_id", "_area", "_number", "_services")
+
     _all_routes = dict()
 
     def __init__(self, route_id):
@@ -495,13 +638,17 @@ class BusRoute:
         """ Add a service to this route """
         self._services[service.service_id] = service
 
-    def active_services(self, on_date):
+    def active_services(self, on_date=None):
         """ Returns a list of the services on this route
-            that are active on the given date """
+            that are active on the given date, by default today """
         if on_date is None:
             now = datetime.utcnow()
             on_date = date(now.year, now.month, now.day)
-        return [s for s in self._services.values() if s.is_active_on_date(on_date)]
+        active_ids = BusService.active_on_date(on_date)
+        return [
+            s for service_id, s in self._services.items()
+            if service_id in active_ids
+        ]
 
     def active_services_today(self):
         """ Returns a list of the services on this route
@@ -561,37 +708,41 @@ class BusRoute:
     def initialize():
         """ Read information about bus routes from the trips.txt file """
         BusRoute._all_routes = dict()
-        with open(os.path.join(_THIS_PATH, "resources", "trips.txt"), "r") as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+        with open(
+            os.path.join(_THIS_PATH, "resources", "trips.txt"), "r", newline=""
+        ) as f:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            for row in reader:
+                if not row:
                     continue
                 # Format is:
                 # route_id,service_id,trip_id,trip_headsign,trip_short_name,
                 # direction_id,block_id,shape_id
-                f = line.split(",")
-                assert len(f) == 8
+                (
+                    route_id, service_id, trip_id, headsign,
+                    short_name, direction, block, _
+                ) = row
+                # Intern strings that repeat across many trips
+                route_id = sys.intern(route_id)
+                short_name = sys.intern(short_name)
+                direction = sys.intern(direction)
                 # Break 'ST.17' into components area='ST' and number='17'
-                route_id = f[0]
                 route = BusRoute.lookup(route_id) or BusRoute(route_id)
                 # Make a unique service id out of the route id
                 # plus the non-unique service id
-                service = BusService.lookup(route_id + "/" + f[1])
+                service = BusService.lookup(route_id + "/" + service_id)
                 route.add_service(service)
                 trip = BusTrip(
-                    trip_id=f[2],
+                    trip_id=trip_id,
                     route_id=route_id,
-                    headsign=f[3],
-                    short_name=f[4],
-                    direction=f[5],
-                    block=f[6],
+                    headsign=headsign,
+                    short_name=short_name,
+                    direction=direction,
+                    block=block,
                 )
-                # We don't use shape_id, f[7], for now
+                # We don't use shape_id, the last field, for now
                 service.add_trip(trip)
 
 
@@ -600,8 +751,25 @@ class BusStop:
     """ A BusStop is a place at a particular location where one or more
         buses stop on their trips. """
 
+    __slots__ = (
+        "_id", "_name", "_skey", "_location",
+        "_lat_rad", "_lon_rad", "_coslat", "_halts", "_visits",
+    )
+
     _all_stops = dict()
     _all_stops_by_name = defaultdict(list)
+    # Structure-of-arrays index of stop locations, for vectorized queries.
+    # _ids and _locs_list are appended to as stops are created;
+    # BusStop.finalize_index() then builds the (N, 2) _locs array,
+    # and a BallTree over it if there are at least _BALL_TREE_MIN_STOPS
+    # stops and scikit-learn is available.
+    # Creating a stop marks the index as dirty, and queries
+    # rebuild it if required.
+    _ids = []
+    _locs_list = []
+    _locs = np.empty((0, 2))
+    _tree = None
+    _index_dirty = False
 
     def __init__(self, stop_id, name, location):
         self._id = stop_id
@@ -612,12 +780,19 @@ class BusStop:
         (lat, lon) = self._location = location
         assert -90.0 <= lat <= 90.0
         assert -180.0 <= lon <= 180.0
+        # Cache the trigonometric values needed for distance calculations
+        self._lat_rad = math.radians(lat)
+        self._lon_rad = math.radians(lon)
+        self._coslat = math.cos(self._lat_rad)
         # Maintain a dictionary of halts at this stop,
         # indexed by arrival time
         self._halts = dict()
         assert stop_id not in BusStop._all_stops
         BusStop._all_stops[stop_id] = self
         BusStop._all_stops_by_name[name].append(self)
+        BusStop._ids.append(stop_id)
+        BusStop._locs_list.append(location)
+        BusStop._index_dirty = True
         # Dict of routes that visit this stop, with each
         # value being a set of directions
         self._visits = defaultdict(set)
@@ -634,21 +809,86 @@ class BusStop:
             stops that are within the given radius (in kilometers). """
         if n < 1:
             return None
-        dist = [
-            (distance(location, stop.location), stop)
-            for stop in BusStop._all_stops.values()
-        ]
-        if within_radius is not None:
-            dist = [(d, stop) for d, stop in dist if d <= within_radius]
-        if not dist:
+        if within_radius is None:
+            return BusStop.nearest(location, k=n)
+        stops = BusStop.within_radius(location, within_radius)
+        if not stops:
             return None
-        # Sort on increasing distance
-        dist = sorted(dist, key=lambda t:t[0])
         if n == 1:
             # Only one stop requested: return it
-            return dist[0][1]
+            return stops[0]
         # More than one stop requested: return a list
-        return [stop for _, stop in dist[0:n]]
+        return stops[0:n]
+
+    @classmethod
+    def _query(cls, location, k):
+        """ Return a tuple of arrays (distances in km, indices into _ids)
+            for the k stops nearest to the given location,
+            in order of increasing distance """
+        if cls._index_dirty:
+            cls.finalize_index()
+        k = min(k, len(cls._locs))
+        if cls._tree is not None:
+            dist, ind = cls._tree.query(np.radians([location]), k=k)
+            return dist[0] * _EARTH_RADIUS, ind[0]
+        dist = distance_batch(location, cls._locs)
+        ind = np.argsort(dist, kind="stable")[0:k]
+        return dist[ind], ind
+
+    @classmethod
+    def _query_radius(cls, location, km):
+        """ Return a tuple of arrays (distances in km, indices into _ids)
+            for the stops within the given radius of the location,
+            in order of increasing distance """
+        if cls._index_dirty:
+            cls.finalize_index()
+        if cls._tree is not None:
+            ind, dist = cls._tree.query_radius(
+                np.radians([location]), r=km / _EARTH_RADIUS,
+                return_distance=True, sort_results=True,
+            )
+            return dist[0] * _EARTH_RADIUS, ind[0]
+        dist = distance_batch(location, cls._locs)
+        ind = np.argsort(dist, kind="stable")
+        ind = ind[dist[ind] <= km]
+        return dist[ind], ind
+
+    @classmethod
+    def nearest(cls, location, k=1):
+        """ Return the bus stop nearest to the given location,
+            or a list of the k nearest stops if k > 1,
+            or None if there are no stops """
+        if k < 1 or not cls._ids:
+            return None
+        _, ind = cls._query(location, k)
+        if k == 1:
+            return cls._all_stops[cls._ids[ind[0]]]
+        return [cls._all_stops[cls._ids[ix]] for ix in ind]
+
+    @classmethod
+    def within_radius(cls, location, km):
+        """ Return a list of the bus stops within the given radius
+            (in kilometers) of the location, nearest first """
+        if not cls._ids:
+            return []
+        _, ind = cls._query_radius(location, km)
+        return [cls._all_stops[cls._ids[ix]] for ix in ind]
+
+    @classmethod
+    def finalize_index(cls):
+        """ Build the location array and spatial index for
+            vectorized queries, once all stops have been created """
+        cls._locs = np.array(cls._locs_list, dtype=np.float64).reshape(-1, 2)
+        cls._tree = None
+        if len(cls._locs) >= _BALL_TREE_MIN_STOPS:
+            try:
+                # scikit-learn is optional, and only imported when needed
+                from sklearn.neighbors import BallTree
+            except ImportError:
+                pass
+            else:
+                cls._tree = BallTree(np.radians(cls._locs), metric="haversine")
+        cls._index_dirty = False
 
     @staticmethod
     def named(name, *, fuzzy=False):
@@ -683,7 +923,23 @@ class BusStop:
     def sort_by_proximity(stops, location):
         """ Sort a list of bus stops by increasing distance from the
             given location """
-        stops.sort(key=lambda stop: distance(location, stop.location))
+        if not stops:
+            return
+        lats = [stop.location[0] for stop in stops]
+        lons = [stop.location[1] for stop in stops]
+        lats.append(location[0])
+        lons.append(location[1])
+        if (
+            max(lats) - min(lats) <= _RANK_DISTANCE_MAX_SPAN and
+            max(lons) - min(lons) <= _RANK_DISTANCE_MAX_SPAN
+        ):
+            # Everything is within a city-sized area, where the cheap
+            # equirectangular approximation orders stops like the
+            # Haversine distance does
+            stops.sort(key=lambda stop: _rank_distance(location, stop.location))
+        else:
+            dist = distance_batch(location, [stop.location for stop in stops])
+            stops[:] = [stops[ix] for ix in np.argsort(dist, kind="stable")]
 
     @staticmethod
     def voice(stop_name):
@@ -717,6 +973,13 @@ class BusStop:
     def location(self):
         return self._location
 
+    def distance_to(self, other):
+        """ Return the distance, in km, to another BusStop or Bus """
+        return _distance_from_radians(
+            self._lat_rad, self._lon_rad, other._lat_rad, other._lon_rad,
+            self._coslat, other._coslat,
+        )
+
     @staticmethod
     def add_halt(stop_id, halt):
         """ Add a halt to this stop, indexed by arrival time """
@@ -729,27 +992,26 @@ class BusStop:
     @staticmethod
     def initialize():
         """ Read information about bus stops from the stops.txt file """
-        with open(os.path.join(_THIS_PATH, "resources", "stops.txt"), "r") as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+        with open(
+            os.path.join(_THIS_PATH, "resources", "stops.txt"), "r", newline=""
+        ) as f:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            for row in reader:
+                if not row:
                     continue
                 # Format is:
                 # stop_id,stop_name,stop_lat,stop_lon,location_type
-                f = line.split(",")
-                assert len(f) == 5
-                stop_id = f[0].strip()
+                assert len(row) == 5
+                stop_id = row[0].strip()
                 assert stop_id not in BusStop._all_stops
                 BusStop(
                     stop_id=stop_id,
-                    name=f[1].strip(),
-                    location=(float(f[2]), float(f[3]))
+                    name=row[1].strip(),
+                    location=(float(row[2]), float(row[3]))
                 )
+        BusStop.finalize_index()
 
 
 class BusHalt:
@@ -757,6 +1019,8 @@ class BusHalt:
     """ The scheduled arrival and departure of a bus at a particular stop
         on a particular trip """
 
+    __slots__ = ("_trip_id", "_stop_id", "_stop_seq", "_arrival_time")
+
     def __init__(self, trip_id, arrival_time, stop_id, stop_sequence):
         self._trip_id = trip_id
         self._stop_id = stop_id
@@ -819,28 +1083,28 @@ class BusHalt:
             """ Convert a hh:mm:ss string to a (h, m, s) tuple """
             return (int(s[0:2]), int(s[3:5]), int(s[6:8]))
 
-        with open(os.path.join(_THIS_PATH, "resources", "stop_times.txt"), "r") as f:
-            index = 0
-            for line in f:
-                index += 1
-                if index == 1:
-                    # Ignore first line
-                    continue
-                line = line.strip()
-                if not line:
+        with open(
+            os.path.join(_THIS_PATH, "resources", "stop_times.txt"), "r", newline=""
+        ) as f:
+            reader = csv.reader(f)
+            # Ignore first line
+            next(reader, None)
+            for row in reader:
+                if not row:
                     continue
                 # Format is:
                 # trip_id,arrival_time,departure_time,stop_id,stop_sequence,stop_headsign,pickup_type
-                f = line.split(",")
-                assert len(f) == 7
+                assert len(row) == 7
+                # The trip_id and stop_id strings repeat across many halts,
+                # so we intern them
                 BusHalt(
-                    f[0].strip(),  # trip_id
-                    to_hms(f[1].strip()),  # arrival_time
-                    # to_hms(f[2].strip()),  # departure_time
-                    f[3].strip(),  # stop_id
-                    int(f[4]),  # stop_sequence
+                    sys.intern(row[0].strip()),  # trip_id
+                    to_hms(row[1].strip()),  # arrival_time
+                    # to_hms(row[2].strip()),  # departure_time
+                    sys.intern(row[3].strip()),  # stop_id
+                    int(row[4]),  # stop_sequence
                     # Ignore stop_headsign (seems to be always empty)
-                    # f[6].strip(),  # pickup_type
+                    # row[6].strip(),  # pickup_type
                 )
 
 
@@ -851,8 +1115,15 @@ class Bus:
         heading, its last or current stop, its next stop,
         and its status code. """
 
+    __slots__ = (
+        "_route_id", "_stop_id", "_next_stop_id", "_location",
+        "_lat_rad", "_lon_rad", "_coslat", "_heading", "_code", "_timestamp",
+    )
+
     _all_buses = defaultdict(list)
-    _timestamp = None
+    # The time.monotonic() value when the state of all buses
+    # was last loaded, or None if it hasn't been loaded
+    _state_loaded = None
     _lock = threading.Lock()
 
     def __init__(
@@ -867,10 +1138,13 @@ class Bus:
         (lat, lon) = self._location = location
         assert -90.0 <= lat <= 90.0
         assert -180.0 <= lon <= 180.0
+        # Cache the trigonometric values needed for distance calculations
+        self._lat_rad = math.radians(lat)
+        self._lon_rad = math.radians(lon)
+        self._coslat = math.cos(self._lat_rad)
         self._heading = heading
         self._code = code
         self._timestamp = timestamp
-        Bus._all_buses[route_id].append(self)
 
     @staticmethod
     def all_buses():
@@ -884,42 +1158,91 @@ class Bus:
         Bus.refresh_state()
         return Bus._all_buses[route_id]
 
+    @staticmethod
+    def _release(elem):
+        """ Free the memory held by an already processed <bus> element """
+        elem.clear()
+        if hasattr(elem, "getprevious"):
+            # lxml: also drop the references that the parent
+            # holds to already processed siblings
+            while elem.getprevious() is not None:
+                del elem.getparent()[0]
+
+    @staticmethod
+    def _parse_buses(source):
+        """ Generate the <bus> elements of a status XML document from
+            a file-like source, incrementally, releasing each element
+            once it has been consumed """
+        try:
+            for _, elem in ET.iterparse(source, events=("end",)):
+                if elem.tag == "bus":
+                    yield elem
+                    Bus._release(elem)
+        finally:
+            source.close()
+
+    @staticmethod
+    def _pull_buses(response):
+        """ Generate the <bus> elements of a status XML document
+            as its chunks arrive in a streamed HTTP response """
+        parser = ET.XMLPullParser(events=("end",))
+        try:
+            for chunk in response.iter_content(65536):
+                parser.feed(chunk)
+                for _, elem in parser.read_events():
+                    if elem.tag == "bus":
+                        yield elem
+                        Bus._release(elem)
+            parser.close()
+        finally:
+            response.close()
+
     @staticmethod
     def _fetch_state():
-        """ Fetch new state via HTTP """
-        r = requests.get(_STATUS_URL) if _STATUS_URL else None
+        """ Fetch new state via HTTP, returning an iterator
+            over <bus> elements """
+        url = _status_url()
+        r = requests.get(url, stream=True) if url else None
         # pylint: disable=no-member
         if r is not None and r.status_code == requests.codes.ok:
-            # print(f"Successfully fetched state from {_STATUS_URL}")
-            html_doc = r.text
-            return ET.fromstring(html_doc)
+            # print(f"Successfully fetched state from {url}")
+            return Bus._pull_buses(r)
+        if r is not None:
+            # Release the connection held by the streamed response
+            r.close()
         # State not available
         return None
 
     @staticmethod
     def _read_state():
-        """ As a fallback, attempt to read bus real-time data from status file """
+        """ As a fallback, attempt to read bus real-time data from status file,
+            returning an iterator over <bus> elements """
         # print(f"Reading state from {_STATUS_FILE}")
         try:
-            return ET.parse(_STATUS_FILE).getroot()
+            f = open(_STATUS_FILE, "rb")
         except FileNotFoundError:
             return None
+        return Bus._parse_buses(f)
 
     @staticmethod
     def _load_state():
         """ Loads a fresh state of all buses from the web """
-        # Clear previous state
-        Bus._all_buses = defaultdict(list)
         # Attempt to fetch state via HTTP
-        root = Bus._fetch_state()
-        if root is None:
+        buses = Bus._fetch_state()
+        if buses is None:
             # Fall back to reading state from file
-            root = Bus._read_state()
-        if root is None:
-            # State is not available
+            buses = Bus._read_state()
+        if buses is None:
+            # State is not available: clear previous state
+            Bus._all_buses = defaultdict(list)
             return
-        for bus in root.findall('bus'):
-            ts = bus.get('time')
+        # First pass: parse the attributes of each bus into a tuple
+        rows = []
+        # Extract the required attributes of a <bus> element in one call
+        get_attrs = itemgetter('time', 'lat', 'lon', 'head', 'route', 'code')
+        for bus in buses:
+            attrs = bus.attrib
+            ts, lat, lon, heading, route_id, code = get_attrs(attrs)
             ts = datetime(
                 year=2000 + int(ts[0:2]),
                 month=int(ts[2:4]),
@@ -928,10 +1251,9 @@ class Bus:
                 minute=int(ts[8:10]),
                 second=int(ts[10:12]),
             )
-            lat = float(bus.get('lat'))
-            lon = float(bus.get('lon'))
-            heading = float(bus.get('head'))
-            route_id = bus.get('route')
+            lat = float(lat)
+            lon = float(lon)
+            heading = float(heading)
             # Convert area indicators
             # !!! TODO: This needs to be verified further, and the 'SA' area added
             if route_id.startswith("A"):
@@ -942,31 +1264,60 @@ class Bus:
                 assert route_id[0] in "123456789"
                 # Assume capital area
                 route_id = "ST." + route_id
-            stop_id = bus.get('stop')
-            next_stop_id = bus.get('next')
-            code = int(bus.get('code'))
-            Bus(
-                route_id=route_id,
-                location=(lat, lon),
-                stop_id=stop_id,
-                next_stop_id=next_stop_id,
-                heading=heading,
-                code=code,
-                timestamp=ts
-            )
-        Bus._timestamp = datetime.utcnow()
+            # The stop attributes may be missing
+            stop_id = attrs.get('stop')
+            next_stop_id = attrs.get('next')
+            code = int(code)
+            # Route and stop ids repeat across buses, so we intern them
+            rows.append((
+                sys.intern(route_id),
+                (lat, lon),
+                stop_id and sys.intern(stop_id),
+                next_stop_id and sys.intern(next_stop_id),
+                heading,
+                code,
+                ts,
+            ))
+        # Second pass: group the buses by route. The sort is stable,
+        # so buses keep their feed order within each route.
+        all_buses = defaultdict(list)
+        rows.sort(key=itemgetter(0))
+        for route_id, group in groupby(rows, key=itemgetter(0)):
+            all_buses[route_id] = [
+                Bus(
+                    route_id=route_id,
+                    location=location,
+                    stop_id=stop_id,
+                    next_stop_id=next_stop_id,
+                    heading=heading,
+                    code=code,
+                    timestamp=ts,
+                )
+                for _, location, stop_id, next_stop_id, heading, code, ts in group
+            ]
+        # Replace the previous state in one step
+        Bus._all_buses = all_buses
+        Bus._state_loaded = monotonic()
+
+    @staticmethod
+    def _is_fresh():
+        """ Return True if the state that we already have is less than
+            _REFRESH_INTERVAL seconds old """
+        loaded = Bus._state_loaded
+        return loaded is not None and monotonic() - loaded < _REFRESH_INTERVAL
 
     @staticmethod
     def refresh_state():
         """ Load a new state, if required """
+        # Check without the lock first: in the common case the state is
+        # fresh and readers don't need to serialize. This is safe since
+        # _load_state() replaces the state in a single assignment.
+        if Bus._is_fresh():
+            return
         with Bus._lock:
-            if Bus._timestamp is not None:
-                delta = datetime.utcnow() - Bus._timestamp
-                if delta.total_seconds() < _REFRESH_INTERVAL:
-                    # The state that we already have is less than
-                    # _REFRESH_INTERVAL seconds old: no need to refresh
-                    return
-            Bus._load_state()
+            # Another thread may have refreshed the state while we waited
+            if not Bus._is_fresh():
+                Bus._load_state()
 
     @property
     def route_id(self):
@@ -980,6 +1331,13 @@ class Bus:
     def location(self):
         return self._location
 
+    def distance_to(self, other):
+        """ Return the distance, in km, to a BusStop or another Bus """
+        return _distance_from_radians(
+            self._lat_rad, self._lon_rad, other._lat_rad, other._lon_rad,
+            self._coslat, other._coslat,
+        )
+
     @property
     def heading(self):
         return self._heading
@@ -1222,13 +1580,13 @@ class BusSchedule:
             # Calculate the distance between the last stop and the next
             # stop of the bus, as the crow flies
             if bus_stop is not None and next_stop is not None:
-                d_stops = distance(bus_stop.location, next_stop.location)
+                d_stops = bus_stop.distance_to(next_stop)
             else:
                 d_stops = 0.0
             # Calculate the distance between the bus and the next stop,
             # as the crow flies
             if next_stop is not None:
-                d_bus = distance(bus.location, next_stop.location)
+                d_bus = bus.distance_to(next_stop)
             else:
                 d_bus = 0.0
             # Approximate the time it would take for the bus to drive
@@ -1400,18 +1758,29 @@ if __name__ == "__main__":
         # Dump the real-time locations of all buses
         # all_buses = Bus.all_buses().items()
         all_buses = [("ST.14", Bus.buses_on_route("ST.14"))]
-        for route_id, val in sorted(all_buses, key=lambda b: b[0].rjust(2)):
+        # Sort by area, then by zero-padded route number, computing
+        # each sort key only once
+        routes = []
+        for route_id, val in all_buses:
+            area, _, number = route_id.partition(".")
+            routes.append(((area, number.zfill(3)), route_id, val))
+        routes.sort(key=itemgetter(0))
+        for _, route_id, val in routes:
             route = BusRoute.lookup(route_id)
             print("{0}:".format(route))
             for service in route.active_services_today():
                 print("   service {0}".format(service.service_id))
-            for bus in sorted(val, key=lambda bus: entf(bus.location)):
+            # Calculate all distances in one pass, then sort on them
+            dists = distance_batch(_MIDEIND_LOCATION, [bus.location for bus in val])
+            keyed = list(zip(dists.tolist(), val))
+            keyed.sort(key=itemgetter(0))
+            for dist, bus in keyed:
                 print(
                     "   {6} loc:{0}, head:{1:>6.2f}, stop:{2}, next:{3}, code:{4}, "
                     "dist:{5:.2f}"
                     .format(
                         locfmt(bus.location), bus.heading, bus.stop,
-                        bus.next_stop, bus.code, entf(bus.location), bus.timestamp
+                        bus.next_stop, bus.code, dist, bus.timestamp
                     )
                 )
 